@@ -1,18 +1,45 @@
 import asyncio
+import atexit
+import concurrent.futures
+import glob
 import json
 import os
 import random
 import shutil
+import signal
+import sys
 import tempfile
-from typing import Any, Dict, Optional
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional, Union
 
-from fastapi import FastAPI, HTTPException, Body, Request
+from fastapi import Depends, FastAPI
 from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field, field_validator
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from multiprocessing import get_context
 
 import nodriver as uc  # requires: pip install nodriver fastapi uvicorn
 
-app = FastAPI(title="RTO Automation API", version="1.0.0")
+try:
+	import fcntl
+except ImportError:  # Windows
+	fcntl = None
+	import msvcrt
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+	await start_browser_pool()
+	# Fire and forget: startup should not wait on a temp dir walk
+	asyncio.get_running_loop().run_in_executor(CLEANUP_POOL, _sweep_orphans)
+	try:
+		yield
+	finally:
+		await stop_browser_pool()
+
+app = FastAPI(title="RTO Automation API", version="1.0.0", lifespan=lifespan)
 
 # Ensure asyncio subprocess works on Windows (fixes NotImplementedError)
 if os.name == "nt":
@@ -21,300 +48,503 @@ if os.name == "nt":
 	except Exception:
 		pass
 
-async def human_delay(min_sec=1, max_sec=3):
-	delay = random.uniform(min_sec, max_sec)
-	await asyncio.sleep(delay)
-
-async def execute_js_and_get_text(page, script: str) -> str:
+# Opt-in crash isolation: run every flow in its own spawned interpreter
+ISOLATE = os.environ.get("RTO_ISOLATE", "0") == "1"
+
+# Warm browser pool: headless Chrome instances started once at app startup and
+# checked out per request, so a run only pays for a new tab, not a new process
+POOL_SIZE = int(os.environ.get("RTO_POOL_SIZE", "2"))
+# Profiles are reused across runs so Chrome's HTTP and V8 code caches stay warm
+PROFILE_ROOT = os.environ.get("RTO_PROFILE_ROOT", tempfile.gettempdir())
+BROWSER_ARGS = [
+	"--no-first-run",
+	"--no-default-browser-check",
+	"--disable-blink-features=AutomationControlled",
+]
+_browser_pool: Optional[asyncio.Queue] = None
+
+# Chrome locks a user-data-dir to a single instance, so every browser that can
+# run at the same time gets its own profile: pool slot ("slot0"), isolation
+# worker ("pid1234") or one-off in-process launch ("spare0"). Slots and spares
+# are claimed with a lock file, which also keeps apart the server processes of
+# `uvicorn --workers N` sharing one RTO_PROFILE_ROOT
+_profile_locks: Dict[str, int] = {}
+# Set in isolation workers by _child_init; each worker runs one flow at a time
+_worker_profile: Optional[str] = None
+
+def profile_dir(suffix: str) -> str:
+	path = os.path.join(PROFILE_ROOT, f"rto_profile_shared_{suffix}")
+	os.makedirs(path, exist_ok=True)
+	return path
+
+def _lock_profile(path: str) -> Optional[int]:
+	# Non-blocking exclusive lock, held until the fd is closed or the process exits
+	fd = os.open(os.path.join(path, ".rto_lock"), os.O_RDWR | os.O_CREAT)
 	try:
-		result = await page.evaluate(script)
-		if hasattr(result, "value"):
-			return str(result.value)
+		if fcntl:
+			fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
 		else:
-			return str(result)
+			msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+	except OSError:
+		os.close(fd)
+		return None
+	return fd
+
+def claim_profile(kind: str) -> str:
+	# Lowest-numbered profile of this kind not locked by any process
+	i = 0
+	while True:
+		path = profile_dir(f"{kind}{i}")
+		fd = _lock_profile(path)
+		if fd is not None:
+			_profile_locks[path] = fd
+			return path
+		i += 1
+
+def release_profile(path: str) -> None:
+	fd = _profile_locks.pop(path, None)
+	if fd is not None:
+		os.close(fd)
+
+# Disk cleanup runs here so it never blocks the event loop or a response
+CLEANUP_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="rto-cleanup")
+# Leftovers younger than this may still belong to another worker process
+ORPHAN_MAX_AGE = 3600
+
+def _sweep_orphans() -> None:
+	# Remove per-run temp profiles and child result files left behind by crashes,
+	# plus profiles of isolation workers that were killed before their own cleanup;
+	# the other shared rto_profile_shared_* profiles are reused and kept
+	now = time.time()
+	tmp = tempfile.gettempdir()
+	paths = glob.glob(os.path.join(tmp, "rto_profile_*")) + glob.glob(os.path.join(tmp, "rto_child_*.json"))
+	paths += glob.glob(os.path.join(PROFILE_ROOT, "rto_profile_shared_pid*"))
+	for path in set(paths):
+		name = os.path.basename(path)
+		if name.startswith("rto_profile_shared") and not name.startswith("rto_profile_shared_pid"):
+			continue
+		try:
+			if now - os.path.getmtime(path) < ORPHAN_MAX_AGE:
+				continue
+			if os.path.isdir(path):
+				shutil.rmtree(path, ignore_errors=True)
+			else:
+				os.remove(path)
+		except OSError:
+			pass
+
+# Installed once per tab with Page.addScriptToEvaluateOnNewDocument, so every
+# document the flow visits already has window.__rto parsed and compiled; each
+# step is then a short call like __rto.home("53") instead of a full IIFE.
+# waitFor/nextAjax resolve in-browser on DOM or PrimeFaces AJAX events.
+RTO_HELPERS_JS = """
+(function(){
+	if (window.__rto) return;
+
+	// Resolves on the next PrimeFaces AJAX completion (false on timeout or without jQuery)
+	function nextAjax(ms){
+		return new Promise(function(resolve){
+			if (!window.jQuery) return resolve(false);
+			var timer = setTimeout(function(){ finish(false); }, ms);
+			function onComplete(){ finish(true); }
+			function finish(v){ jQuery(document).off('pfAjaxComplete', onComplete); clearTimeout(timer); resolve(v); }
+			jQuery(document).on('pfAjaxComplete', onComplete);
+		});
+	}
+
+	function waitFor(pred, ms){
+		return new Promise(function(resolve){
+			function check(){ try { return pred(); } catch(e) { return null; } }
+			var hit = check();
+			if (hit) return resolve(hit);
+			// Mutations catch re-rendered nodes, the poll catches property-only changes (input.value)
+			var obs = new MutationObserver(done), poll = setInterval(done, 250);
+			var timer = setTimeout(function(){ finish(null); }, ms);
+			function done(){ var hit = check(); if (hit) finish(hit); }
+			function finish(v){ obs.disconnect(); clearInterval(poll); clearTimeout(timer); resolve(v); }
+			obs.observe(document.documentElement, {childList:true, subtree:true, attributes:true});
+		});
+	}
+
+	// Rendered with a size, i.e. not a hidden, pre-rendered dialog element
+	function isVisible(el){
+		var r = el.getBoundingClientRect();
+		return r.width>0 && r.height>0;
+	}
+
+	// Early-exit scan of a live HTMLCollection (no NodeList-to-Array copy)
+	function firstMatch(collection, pred){
+		for (var i=0;i<collection.length;i++){ if (pred(collection[i])) return collection[i]; }
+		return null;
+	}
+
+	// One Event per type, re-dispatched to every element once the previous dispatch finished
+	function fireInputEvents(els){
+		['input','change','blur'].forEach(function(type){
+			var evt = new Event(type, {bubbles:true});
+			for (var i=0;i<els.length;i++) els[i].dispatchEvent(evt);
+		});
+	}
+
+	async function step(steps, label, fn){
+		var res;
+		try { res = await fn(); } catch(e) { res = {ok: false, err: e.message}; }
+		steps.push({label: label, ok: !!res.ok, data: res.data, err: res.err});
+		return res;
+	}
+
+	var R = window.__rto = {
+		nextAjax: nextAjax,
+		waitFor: waitFor,
+
+		setRto: async function(rtoValue){
+			var selectElement = document.getElementById('fit_c_office_to_input');
+			var labelElement = document.getElementById('fit_c_office_to_label');
+			if (!selectElement || !labelElement) return {ok: false, err: 'Elements not found'};
+			selectElement.value = rtoValue;
+			labelElement.textContent = 'BURARI AUTO UNIT (DL' + rtoValue + ')';
+			fireInputEvents([selectElement]);
+			if (typeof PrimeFaces !== 'undefined' && PrimeFaces.ab) {
+				var updated = nextAjax(5000);
+				PrimeFaces.ab({ s: "fit_c_office_to", e: "change", f: "homepageformid", p: "fit_c_office_to" });
+				await updated;
+			}
+			return {ok: true};
+		},
+
+		clickCheckbox: async function(){
+			var el = await waitFor(function(){
+				var selectors = ['.ui-chkbox-icon', '.ui-chkbox-box', 'input[type="checkbox"]'];
+				for (var s=0;s<selectors.length;s++){
+					var els = document.querySelectorAll(selectors[s]);
+					for (var i=0;i<els.length;i++){
+						if (isVisible(els[i])) return els[i];
+					}
+				}
+				return null;
+			}, 5000);
+			if (!el) return {ok: false, err: 'not found'};
+			el.click(); return {ok: true};
+		},
+
+		proceed1: async function(){
+			var btn = document.getElementById('proccedHomeButtonId'), via = 'via ID';
+			if (!btn){
+				via = 'via text';
+				btn = firstMatch(document.getElementsByTagName('button'), function(b){
+					return (b.textContent||'').toLowerCase().includes('proceed');
+				});
+			}
+			if (!btn) return {ok: false, err: 'no proceed button'};
+			// Wait for the AJAX that opens the dialog, so pfProceed's own nextAjax
+			// cannot resolve on this request's completion
+			var done = nextAjax(10000);
+			btn.click();
+			await done;
+			return {ok: true, data: via};
+		},
+
+		// PrimeFaces proceed in the dialog opened by proceed1
+		pfProceed: async function(){
+			var btn = await waitFor(function(){
+				var b = firstMatch(document.getElementsByTagName('button'), function(b){
+					return b.id !== 'proccedHomeButtonId' && isVisible(b) &&
+					       (b.getAttribute('onclick')||'').includes('PrimeFaces.ab') &&
+					       (b.textContent||'').toLowerCase().includes('proceed');
+				});
+				var fallback = document.getElementById('j_idt444');
+				return b || (fallback && isVisible(fallback) ? fallback : null);
+			}, 8000);
+			if(!btn) return {ok: false, err: 'no button'};
+			var oc = btn.getAttribute('onclick')||'';
+			var fm = oc.match(/f:"([^"]+)"/), sm = oc.match(/s:"([^"]+)"/);
+			var done = nextAjax(10000);
+			if(fm && sm && typeof PrimeFaces!=='undefined'){ PrimeFaces.ab({s:sm[1], f:fm[1]}); await done; return {ok: true, data: 'PF.ab'}; }
+			btn.click(); await done; return {ok: true, data: 'click'};
+		},
+
+		openServices: async function(){
+			var el = await waitFor(function(){ return document.querySelector('a#navbarDropdownMenuLink'); }, 10000);
+			if(el){ el.click(); return {ok: true}; }
+			return {ok: false, err: 'no services menu'};
+		},
+
+		openRcServices: async function(){
+			var el = await waitFor(function(){
+				return document.querySelector('.dropdown-item[href*="rcrelated" i], .dropdown-item[data-menu*="rcrelated" i]')
+				    || firstMatch(document.getElementsByClassName('dropdown-item'), function(e){
+					var t=(e.textContent||'').trim().toLowerCase();
+					return t.includes('rc') && t.includes('related') && t.includes('services');
+				});
+			}, 3000);
+			if(!el) return {ok: false, err: 'no RC related services item'};
+			el.click(); return {ok: true};
+		},
+
+		openReschedule: async function(){
+			var a = await waitFor(function(){
+				return document.getElementById('fitbalcTest')
+				     || document.querySelector('a[onclick*="fitbalcTest"]')
+				     || firstMatch(document.getElementsByTagName('a'), function(el){ return (el.textContent||'').includes('Re-Schedule Renewal of Fitness Application'); });
+			}, 3000);
+			if(!a) return {ok: false, err: 'no Re-Schedule link'};
+			// Navigate on the next tick so the caller can return before the page unloads
+			var oc = a.getAttribute('onclick')||'';
+			var form = document.getElementById('loginForm');
+			if(oc.includes('mojarra.jsfcljs') && form){
+				setTimeout(function(){ mojarra.jsfcljs(form, {'fitbalcTest':'fitbalcTest','pur_cd':'86'}, ''); }, 0);
+				return {ok: true, data: 'mojarra'};
+			}
+			setTimeout(function(){ a.click(); }, 0);
+			return {ok: true, data: 'click'};
+		},
+
+		fillForm: async function(regNo, chassisNo){
+			var reg = await waitFor(function(){ return document.getElementById('balanceFeesFine:tf_reg_no'); }, 10000);
+			var ch = document.getElementById('balanceFeesFine:tf_chasis_no');
+			if(!reg || !ch) return {ok: false, err: 'inputs not found'};
+			reg.value = regNo;
+			ch.value = chassisNo;
+			fireInputEvents([reg, ch]);
+			return {ok: true};
+		},
+
+		validate: function(){
+			var b = document.getElementById('balanceFeesFine:validate_dtls');
+			if(!b) return {ok: false, err: 'no validate button'};
+			if (typeof PrimeFaces !== 'undefined'){
+				PrimeFaces.ab({ s:'balanceFeesFine:validate_dtls', f:'balanceFeesFine', u:'balanceFeesFine:auth_panel',
+					onst:function(cfg){ try{ if(PF('statusDialog')) PF('statusDialog').show(); }catch(e){} },
+					onsu:function(){ try{ if(PF('statusDialog')) PF('statusDialog').hide(); }catch(e){} }
+				});
+				return {ok: true, data: 'PF.ab'};
+			}
+			b.click(); return {ok: true, data: 'click'};
+		},
+
+		// Read the mobile number once the auth panel has been re-rendered with it
+		getMobile: async function(){
+			var m = await waitFor(function(){
+				var f = document.getElementById('balanceFeesFine:tf_mobile');
+				return f && f.value ? f : null;
+			}, 10000) || document.getElementById('balanceFeesFine:tf_mobile');
+			if(!m) return {ok: false, err: 'field not found'};
+			return {ok: true, data: m.value.trim()};
+		},
+
+		// Batches: one evaluate per page, each returning {steps: [{label, ok, data|err}]}
+		home: async function(rtoValue){
+			var steps = [];
+			await step(steps, 'Set RTO', function(){ return R.setRto(rtoValue); });
+			await step(steps, 'Click checkbox', R.clickCheckbox);
+			await step(steps, 'Proceed #1', R.proceed1);
+			await step(steps, 'PF proceed', R.pfProceed);
+			return {steps: steps};
+		},
+
+		services: async function(){
+			var steps = [];
+			await step(steps, 'Open Services', R.openServices);
+			await step(steps, 'Open RC Related Services', R.openRcServices);
+			await step(steps, 'Open Re-Schedule link', R.openReschedule);
+			return {steps: steps};
+		},
+
+		form: async function(regNo, chassisNo){
+			var steps = [];
+			var filled = await step(steps, 'Fill form', function(){ return R.fillForm(regNo, chassisNo); });
+			if (!filled.ok) return {steps: steps};
+			await step(steps, 'Validate', R.validate);
+			await step(steps, 'Get mobile', R.getMobile);
+			return {steps: steps};
+		}
+	};
+})();
+"""
+
+RTO_ORIGIN = "https://vahan.parivahan.gov.in"
+RTO_URL = "https://vahan.parivahan.gov.in/vahanservice/vahan/ui/statevalidation/homepage.xhtml?statecd=Mzc2MzM2MzAzNjY0MzIzODM3NjIzNjY0MzY2MjM3NDQ0Yw=="
+
+# wait_for predicates for the page transitions in run_flow
+PAGE_LOADED_JS = "document.readyState === 'complete'"
+MODAL_HIDDEN_JS = "!(document.querySelector('.btn-close') || {}).offsetParent"
+SERVICES_READY_JS = "document.readyState === 'complete' && !!document.querySelector('a#navbarDropdownMenuLink')"
+FORM_READY_JS = "document.readyState === 'complete' && !!document.getElementById('balanceFeesFine:tf_reg_no')"
+
+# Scales the anti-bot click jitter; 0 turns it off in trusted environments
+HUMAN_DELAY_MULTIPLIER = float(os.environ.get("RTO_HUMAN_DELAY_MULTIPLIER", "1"))
+
+async def human_delay(min_sec=1, max_sec=3, _random=random.random, _sleep=asyncio.sleep, _mul=HUMAN_DELAY_MULTIPLIER):
+	# random/sleep/multiplier are bound as defaults so lookups stay local
+	delay = (min_sec + (max_sec - min_sec) * _random()) * _mul
+	if delay > 0:
+		await _sleep(delay)
+
+async def evaluate_by_value(page, expression: str, await_promise: bool = False) -> Any:
+	# Tab.evaluate always requests deep serialization, which overrides returnByValue
+	# and leaves RemoteObject.value unset for objects like the batches' {steps: [...]},
+	# so send Runtime.evaluate without it and read the JSON value directly
+	remote_object, exception = await page.send(uc.cdp.runtime.evaluate(
+		expression=expression,
+		await_promise=await_promise,
+		return_by_value=True,
+		user_gesture=True,
+		allow_unsafe_eval_blocked_by_csp=True,
+	))
+	if exception:
+		raise RuntimeError(exception.exception.description if exception.exception else exception.text)
+	return remote_object.value
+
+async def execute_js(page, script: str, await_promise: bool = False) -> Any:
+	# Helpers return {ok, data} / {ok, err} objects, which arrive as plain dicts;
+	# other values are returned as-is (no str() round-trip for str/int/bool).
+	# Thrown JS errors and protocol failures take the same {ok, err} shape.
+	try:
+		return await evaluate_by_value(page, script, await_promise=await_promise)
 	except Exception as e:
-		return f"ERROR: JavaScript execution error: {e}"
+		return {"ok": False, "err": f"JavaScript execution error: {e}"}
+
+async def call_js(page, fn: str, *args) -> Any:
+	# Call an __rto function; the arguments are written into the expression as one
+	# json.dumps array literal spread into the call, so they always parse as data
+	return await execute_js(page, f"{fn}(...{json.dumps(args)})", await_promise=True)
+
+async def wait_for(page, js_predicate: str, timeout: float = 10) -> bool:
+	# Resolves in-browser the moment js_predicate holds; a navigation tearing down
+	# the document mid-wait just rejects the evaluate, so retry until the deadline
+	loop = asyncio.get_running_loop()
+	deadline = loop.time() + timeout
+	while True:
+		remaining = deadline - loop.time()
+		if remaining <= 0:
+			return False
+		script = f"__rto.waitFor(function(){{ return {js_predicate}; }}, {int(remaining * 1000)}).then(Boolean)"
+		if await execute_js(page, script, await_promise=True) is True:
+			return True
+		await asyncio.sleep(0.1)
 
 async def clear_storage(page) -> None:
-	# Best-effort clear of cookies/storage in the current tab
+	# Best-effort reset of site state before navigating: every cookie, including
+	# HttpOnly session cookies like JSESSIONID that document.cookie cannot touch,
+	# plus the origin's storage. HTTP cache and service workers stay warm.
 	try:
-		await execute_js_and_get_text(page, """
-			(function(){
-				try {
-					// Clear local/session storage
-					if (window.localStorage) localStorage.clear();
-					if (window.sessionStorage) sessionStorage.clear();
-					// Best-effort cookie clear (non-HttpOnly)
-					document.cookie.split(';').forEach(function(c) {
-						var d = c.indexOf('=') > -1 ? c.substring(0, c.indexOf('=')) : c;
-						document.cookie = d.trim() + '=;expires=Thu, 01 Jan 1970 00:00:00 GMT;path=/';
-					});
-					return 'SUCCESS: storage cleared';
-				} catch (e) { return 'ERROR: ' + e.message; }
-			})()
-		""")
+		await asyncio.gather(
+			page.send(uc.cdp.network.clear_browser_cookies()),
+			page.send(uc.cdp.storage.clear_data_for_origin(origin=RTO_ORIGIN, storage_types="local_storage,indexeddb")),
+		)
 	except:
 		pass
 
-async def run_flow(reg_no: str, chassis_no: str, rto_value: str = "53", headless: bool = True, timeout_sec: int = 120) -> Dict[str, Any]:
-	messages = []
+async def run_flow(reg_no: str, chassis_no: str, rto_value: str = "53", headless: bool = True, timeout_sec: int = 120, browser=None) -> Dict[str, Any]:
+	# Bounded so a runaway flow cannot grow the log without limit
+	messages = deque(maxlen=512)
+	log = messages.append
 	result: Dict[str, Any] = {
 		"success": False,
 		"mobile_number": None,
-		"details": {"messages": messages},
+		"details": {"messages": []},
 	}
-	temp_profile = tempfile.mkdtemp(prefix="rto_profile_")
-	browser = None
+	# A pooled browser is borrowed: only open/close a tab in it, never stop it
+	owns_browser = browser is None
+	spare = None
+	if owns_browser:
+		if _worker_profile:
+			profile = _worker_profile
+		else:
+			profile = spare = claim_profile("spare")
 	page = None
 
-	def log(msg: str):
-		messages.append(msg)
-
-	async def step_js(page, label: str, script: str) -> str:
-		out = await execute_js_and_get_text(page, script)
-		log(f"{label}: {out}")
-		return out
+	async def step_batch(page, fn: str, *args) -> Dict[str, Dict[str, Any]]:
+		# Run one __rto batch in a single evaluate and log each step's outcome
+		out = await call_js(page, fn, *args)
+		if not isinstance(out, dict) or "steps" not in out:
+			log(f"ERROR: {out.get('err') if isinstance(out, dict) else out}")
+			return {}
+		steps: Dict[str, Dict[str, Any]] = {}
+		for s in out["steps"]:
+			steps[s["label"]] = s
+			if s["ok"]:
+				log(f"{s['label']}: SUCCESS" + (f": {s['data']}" if s.get("data") else ""))
+			else:
+				log(f"{s['label']}: ERROR: {s.get('err')}")
+		return steps
 
 	async def main():
 		nonlocal browser, page
 		log("Starting NoDriver automation...")
-		browser_args = [
-			f"--user-data-dir={temp_profile}",
-			"--incognito",
-			"--no-first-run",
-			"--no-default-browser-check",
-			"--disable-blink-features=AutomationControlled",
-		]
-		# Start isolated browser instance
-		browser = await uc.start(headless=headless, browser_args=browser_args)
 		try:
-			url = "https://vahan.parivahan.gov.in/vahanservice/vahan/ui/statevalidation/homepage.xhtml?statecd=Mzc2MzM2MzAzNjY0MzIzODM3NjIzNjY0MzY2MjM3NDQ0Yw=="
+			if owns_browser:
+				browser_args = [
+					f"--user-data-dir={profile}",
+					*BROWSER_ARGS,
+				]
+				# Start isolated browser instance
+				browser = await uc.start(headless=headless, browser_args=browser_args)
 			log("Loading website...")
-			page = await browser.get(url)
-			await human_delay(2, 4)
-			await clear_storage(page)
+			page = await browser.get("about:blank", new_tab=not owns_browser)
+			# Profiles persist across runs, so reset site state before the first request
+			# to the site sends the previous run's session cookie
+			await asyncio.gather(
+				page.send(uc.cdp.page.add_script_to_evaluate_on_new_document(source=RTO_HELPERS_JS)),
+				clear_storage(page),
+			)
+			await page.send(uc.cdp.page.navigate(url=RTO_URL))
+			# __rto only exists once the site's document replaced about:blank
+			await wait_for(page, PAGE_LOADED_JS, timeout=20)
 
 			# Close modal if present
 			try:
 				close_button = await page.select(".btn-close")
 				if (close_button):
-					await human_delay(0.3, 1.0)
+					await human_delay(0.05, 0.2)
 					await close_button.click()
 					log("Modal dialog closed")
-					await human_delay(0.8, 1.5)
+					await wait_for(page, MODAL_HIDDEN_JS, timeout=3)
 				else:
 					log("Modal dialog not found")
 			except Exception as e:
 				log(f"Modal close error: {e}")
 
 			# RTO dropdown click (best-effort)
-			await human_delay(1, 2)
 			try:
 				rto_label = await page.select("#fit_c_office_to_label")
 				if rto_label:
+					await human_delay(0.05, 0.2)
 					await rto_label.click()
 					log("Clicked RTO dropdown")
-					await human_delay(1, 2)
 				else:
 					log("RTO dropdown not found")
 			except Exception as e:
 				log(f"RTO dropdown click error: {e}")
 
-			# Set RTO directly
-			await step_js(page, "Set RTO", f"""
-				(function(){{
-					try {{
-						var selectElement = document.getElementById('fit_c_office_to_input');
-						var labelElement = document.getElementById('fit_c_office_to_label');
-						if (!selectElement || !labelElement) return 'ERROR: Elements not found';
-						selectElement.value = {json.dumps(rto_value)};
-						labelElement.textContent = 'BURARI AUTO UNIT (DL{rto_value})';
-						['input','change','blur'].forEach(function(evt){{
-							selectElement.dispatchEvent(new Event(evt, {{bubbles:true}}));
-						}});
-						if (typeof PrimeFaces !== 'undefined' && PrimeFaces.ab) {{
-							PrimeFaces.ab({{ s: "fit_c_office_to", e: "change", f: "homepageformid", p: "fit_c_office_to" }});
-						}}
-						return 'SUCCESS';
-					}} catch(e) {{ return 'ERROR: ' + e.message; }}
-				}})()
-			""")
-			await human_delay(2, 4)
-
-			# Check privacy checkbox
-			await step_js(page, "Click checkbox", """
-				(function(){
-					var selectors = ['.ui-chkbox-icon', '.ui-chkbox-box', 'input[type="checkbox"]'];
-					for (var s=0;s<selectors.length;s++){
-						var els = document.querySelectorAll(selectors[s]);
-						for (var i=0;i<els.length;i++){
-							var el = els[i];
-							var r = el.getBoundingClientRect();
-							if (r.width>0 && r.height>0) { el.click(); return 'SUCCESS'; }
-						}
-					}
-					return 'ERROR: not found';
-				})()
-			""")
-			await human_delay(0.5, 1.5)
-
-			# First Proceed
-			await step_js(page, "Proceed #1", """
-				(function(){
-					var btn = document.getElementById('proccedHomeButtonId');
-					if (btn){ btn.click(); return 'SUCCESS: via ID'; }
-					var buttons = document.querySelectorAll('button');
-					for (var i=0;i<buttons.length;i++){
-						var t = (buttons[i].textContent||'').toLowerCase();
-						if (t.includes('proceed')) { buttons[i].click(); return 'SUCCESS: via text'; }
-					}
-					return 'ERROR';
-				})()
-			""")
-			await human_delay(2, 4)
-
-			# PrimeFaces proceed in dialog
-			pf_find = await step_js(page, "Find PF proceed", """
-				(function(){
-					try{
-						var buttons = document.querySelectorAll('button');
-						for (var i=0;i<buttons.length;i++){
-							var btn = buttons[i], onclick = btn.getAttribute('onclick')||'', t=(btn.textContent||'').toLowerCase();
-							if (onclick.includes('PrimeFaces.ab') && t.includes('proceed')){
-								return 'SUCCESS: id=' + btn.id;
-							}
-						}
-						var b = document.getElementById('j_idt444'); if (b) return 'SUCCESS: j_idt444';
-						return 'ERROR';
-					}catch(e){return 'ERROR: '+e.message;}
-				})()
-			""")
-			if "SUCCESS" in pf_find:
-				await step_js(page, "Click PF proceed", """
-					(function(){
-						try{
-							var btn = document.getElementById('j_idt444');
-							if(!btn){
-								var buttons = document.querySelectorAll('button');
-								for (var i=0;i<buttons.length;i++){
-									var b = buttons[i];
-									if ((b.getAttribute('onclick')||'').includes('PrimeFaces.ab') &&
-									    (b.textContent||'').toLowerCase().includes('proceed')) { btn=b; break; }
-								}
-							}
-							if(!btn) return 'ERROR: no button';
-							var oc = btn.getAttribute('onclick')||'';
-							var fm = oc.match(/f:"([^"]+)"/), sm = oc.match(/s:"([^"]+)"/);
-							if(fm && sm && typeof PrimeFaces!=='undefined'){ PrimeFaces.ab({s:sm[1], f:fm[1]}); return 'SUCCESS: PF.ab'; }
-							btn.click(); return 'SUCCESS: click';
-						}catch(e){return 'ERROR: '+e.message;}
-					})()
-				""")
-			await human_delay(2, 3)
-
-			# Navigate to Re-Schedule Renewal of Fitness Application
-			await step_js(page, "Open Services", """
-				(function(){
-					var el = document.querySelector('a#navbarDropdownMenuLink');
-					if(el){ el.click(); return 'SUCCESS'; }
-					return 'ERROR';
-				})()
-			""")
-			await human_delay(1, 2)
-			await step_js(page, "Open RC Related Services", """
-				(function(){
-					try{
-						var el = Array.from(document.querySelectorAll('.dropdown-item')).find(function(e){
-							var t=(e.textContent||'').trim().toLowerCase();
-							return t.includes('rc') && t.includes('related') && t.includes('services');
-						});
-						if(!el) return 'ERROR';
-						el.click(); return 'SUCCESS';
-					}catch(e){return 'ERROR: '+e.message;}
-				})()
-			""")
-			await human_delay(1, 2)
-			await step_js(page, "Open Re-Schedule link", """
-				(function(){
-					try{
-						var a = document.getElementById('fitbalcTest')
-						     || Array.from(document.querySelectorAll('a')).find(el => (el.textContent||'').includes('Re-Schedule Renewal of Fitness Application'));
-						if(!a) return 'ERROR';
-						var oc = a.getAttribute('onclick')||'';
-						if(oc.includes('mojarra.jsfcljs')){
-							var form = document.getElementById('loginForm');
-							if(form){ mojarra.jsfcljs(form, {'fitbalcTest':'fitbalcTest','pur_cd':'86'}, ''); return 'SUCCESS: mojarra'; }
-						}
-						a.click(); return 'SUCCESS: click';
-					}catch(e){return 'ERROR: '+e.message;}
-				})()
-			""")
-			await human_delay(2, 3)
-
-			# Fill validation form with provided parameters
-			reg_js = json.dumps(reg_no)
-			ch_js = json.dumps(chassis_no)
-			fill_out = await step_js(page, "Fill form", f"""
-				(function(){{
-					try{{
-						var reg = document.getElementById('balanceFeesFine:tf_reg_no');
-						var ch = document.getElementById('balanceFeesFine:tf_chasis_no');
-						if(!reg || !ch) return 'ERROR: inputs not found';
-						reg.value = {reg_js};
-						ch.value = {ch_js};
-						['input','change','blur'].forEach(function(t){{ reg.dispatchEvent(new Event(t,{{bubbles:true}})); ch.dispatchEvent(new Event(t,{{bubbles:true}})); }});
-						return 'SUCCESS';
-					}}catch(e){{return 'ERROR: '+e.message;}}
-				}})()
-			""")
-			if "SUCCESS" not in fill_out:
-				return
-
-			await human_delay(0.8, 1.5)
-			val_out = await step_js(page, "Validate", """
-				(function(){
-					try{
-						var b = document.getElementById('balanceFeesFine:validate_dtls');
-						if(!b) return 'ERROR: btn';
-						if (typeof PrimeFaces !== 'undefined'){
-							PrimeFaces.ab({ s:'balanceFeesFine:validate_dtls', f:'balanceFeesFine', u:'balanceFeesFine:auth_panel',
-								onst:function(cfg){ try{ if(PF('statusDialog')) PF('statusDialog').show(); }catch(e){} },
-								onsu:function(){ try{ if(PF('statusDialog')) PF('statusDialog').hide(); }catch(e){} }
-							});
-							return 'SUCCESS: PF.ab';
-						}
-						b.click(); return 'SUCCESS: click';
-					}catch(e){return 'ERROR: '+e.message;}
-				})()
-			""")
-			await human_delay(2, 3)
-
-			# Extract mobile number
-			mob_out = await step_js(page, "Get mobile", """
-				(function(){
-					try{
-						var m = document.getElementById('balanceFeesFine:tf_mobile');
-						if(!m) return 'ERROR: field not found';
-						return 'SUCCESS: ' + m.value;
-					}catch(e){return 'ERROR: '+e.message;}
-				})()
-			""")
-			if "SUCCESS:" in mob_out:
-				result["mobile_number"] = mob_out.split("SUCCESS:",1)[1].strip()
+			# Home page: set RTO, accept the privacy notice and proceed (one round-trip)
+			await step_batch(page, "__rto.home", rto_value)
+			await wait_for(page, SERVICES_READY_JS, timeout=15)
+
+			# Navigate to Re-Schedule Renewal of Fitness Application. Kept separate from
+			# the home batch because PF proceed may navigate, which kills an in-flight evaluate.
+			await step_batch(page, "__rto.services")
+			await wait_for(page, FORM_READY_JS, timeout=15)
+
+			# Fill validation form, validate and read back the mobile number
+			form = await step_batch(page, "__rto.form", reg_no, chassis_no)
+			mobile = form.get("Get mobile")
+			if mobile and mobile["ok"]:
+				result["mobile_number"] = mobile.get("data", "")
 				result["success"] = True
 
 		except Exception as e:
 			log(f"Error: {e}")
 		finally:
-			try:
-				await human_delay(0.5, 1.0)
-				if page:
-					await clear_storage(page)
-			except:
-				pass
-			if browser:
+			if owns_browser:
+				if browser:
+					try:
+						browser.stop()
+					except:
+						pass
+			elif page:
 				try:
-					browser.stop()
+					await page.close()
 				except:
 					pass
 
@@ -322,116 +552,229 @@ async def run_flow(reg_no: str, chassis_no: str, rto_value: str = "53", headless
 		await asyncio.wait_for(main(), timeout=timeout_sec)
 	except asyncio.TimeoutError:
 		log("ERROR: Flow timed out")
+	except Exception as e:
+		log(f"Error: {e}")
+	finally:
+		if spare is not None:
+			release_profile(spare)
 
-	# Cleanup temp profile
-	try:
-		shutil.rmtree(temp_profile, ignore_errors=True)
-	except:
-		pass
-
+	result["details"]["messages"] = list(messages)
 	return result
 
-# Run automation in a spawned child process (Windows-friendly for subprocess)
-def _child_run_flow(reg_no: str, chassis_no: str, rto_value: str, headless: bool, timeout_sec: int, out_path: str):
-	try:
-		# Ensure Proactor loop in child
-		if os.name == "nt":
+# Isolated runs (RTO_ISOLATE=1) go to a bounded pool of spawned interpreters that
+# stay warm across requests; on Python 3.11+ workers are recycled after
+# RTO_WORKER_MAX_TASKS runs
+WORKERS = int(os.environ.get("RTO_WORKERS", "2"))
+WORKER_MAX_TASKS = int(os.environ.get("RTO_WORKER_MAX_TASKS", "50"))
+
+def _child_init():
+	global _worker_profile
+	# Each worker launches its own browser, so it needs its own profile; it is
+	# reused across the worker's runs and removed when the worker exits
+	_worker_profile = profile_dir(f"pid{os.getpid()}")
+	atexit.register(shutil.rmtree, _worker_profile, True)
+	if os.name != "nt":
+		signal.signal(signal.SIGTERM, _child_terminate)
+	# Ensure Proactor loop in child
+	if os.name == "nt":
+		try:
+			asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+		except Exception:
+			pass
+
+def _child_terminate(signum, frame):
+	# Sent by _teardown_process_pool; atexit does not run on a signal, so stop
+	# this worker's Chrome and remove its profile here before exiting
+	for browser in list(uc.util.get_registered_instances()):
+		if not browser.stopped:
 			try:
-				asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+				browser.stop()
 			except Exception:
 				pass
-		# Run the existing async flow
-		res = asyncio.run(run_flow(reg_no=reg_no, chassis_no=chassis_no, rto_value=rto_value, headless=headless, timeout_sec=timeout_sec))
-	except Exception as e:
-		res = {"success": False, "mobile_number": None, "details": {"messages": [f"child_error: {e}"]}}
-	# Persist result to temp file
+	shutil.rmtree(_worker_profile, True)
+	os._exit(1)
+
+def _child_run_flow_inline(reg_no: str, chassis_no: str, rto_value: str, headless: bool, timeout_sec: int) -> Dict[str, Any]:
 	try:
-		with open(out_path, "w", encoding="utf-8") as f:
-			json.dump(res, f, ensure_ascii=False)
-	except Exception:
-		pass
+		return asyncio.run(run_flow(reg_no=reg_no, chassis_no=chassis_no, rto_value=rto_value, headless=headless, timeout_sec=timeout_sec))
+	except Exception as e:
+		return {"success": False, "mobile_number": None, "details": {"messages": [f"child_error: {e}"]}}
+
+def _child_ping() -> int:
+	return os.getpid()
+
+class _WorkerContext(type(get_context("spawn"))):
+	# Spawn context that keeps the worker processes it starts, so a pool's
+	# workers can be terminated without the executor's private state
+	def __init__(self):
+		super().__init__()
+		self.workers = []
+
+	def Process(self, *args, **kwargs):
+		process = super().Process(*args, **kwargs)
+		# Drop workers that already exited (recycled after max_tasks_per_child)
+		self.workers = [p for p in self.workers if p.exitcode is None] + [process]
+		return process
+
+# Worker context per live pool, and the requests in flight on it, so a retired
+# pool is torn down only once the last of them has returned rather than under
+# runs that are still healthy
+_pool_workers: Dict[ProcessPoolExecutor, _WorkerContext] = {}
+_pool_runs: Dict[ProcessPoolExecutor, set] = {}
+
+def _new_process_pool() -> ProcessPoolExecutor:
+	kwargs = {}
+	if sys.version_info >= (3, 11):  # max_tasks_per_child is 3.11+; older workers just never recycle
+		kwargs["max_tasks_per_child"] = WORKER_MAX_TASKS
+	context = _WorkerContext()
+	pool = ProcessPoolExecutor(
+		max_workers=WORKERS,
+		mp_context=context,
+		initializer=_child_init,
+		**kwargs,
+	)
+	_pool_workers[pool] = context
+	# The executor spawns workers lazily; one no-op task each makes it start all
+	# of them now, so no request waits on interpreter startup and imports
+	for _ in range(WORKERS):
+		pool.submit(_child_ping)
+	return pool
+
+def _replace_process_pool(pool: ProcessPoolExecutor) -> None:
+	# Every request in flight on a broken or hung pool lands here; only the first
+	# one swaps it out, so later ones don't retire its successor
+	if app.state.process_pool is pool:
+		app.state.process_pool = _new_process_pool()
+
+def _teardown_process_pool(pool: ProcessPoolExecutor) -> None:
+	# Cancelling the asyncio wrapper leaves a timed-out run going in its worker
+	# (and holding one of RTO_WORKERS), so the workers are terminated outright
+	context = _pool_workers.pop(pool)
+	pool.shutdown(wait=False, cancel_futures=True)
+	for p in context.workers:
+		if p.exitcode is None:
+			try:
+				p.terminate()
+			except Exception:
+				pass
 
-def _run_in_child_sync(reg_no: str, chassis_no: str, rto_value: str, headless: bool, timeout_sec: int) -> Dict[str, Any]:
-	# Create temp file path for result (avoid NamedTemporaryFile on Windows)
-	fd, out_path = tempfile.mkstemp(prefix="rto_child_", suffix=".json")
-	os.close(fd)
-	ctx = get_context("spawn")
-	p = ctx.Process(target=_child_run_flow, args=(reg_no, chassis_no, rto_value, headless, timeout_sec, out_path), daemon=True)
-	p.start()
-	p.join(timeout_sec + 60)  # grace period
-	if p.is_alive():
+async def _run_isolated(reg_no: str, chassis_no: str, rto_value: str, headless: bool, timeout_sec: int) -> Dict[str, Any]:
+	loop = asyncio.get_running_loop()
+	# Wait for a free worker here rather than in the executor's queue, so the
+	# timeout below covers the run itself and never time spent queued
+	async with app.state.worker_slots:
+		pool = app.state.process_pool
+		runs = _pool_runs.setdefault(pool, set())
+		run = asyncio.current_task()
+		runs.add(run)
 		try:
-			p.terminate()
+			return await asyncio.wait_for(
+				loop.run_in_executor(pool, _child_run_flow_inline, reg_no, chassis_no, rto_value, headless, timeout_sec),
+				timeout=timeout_sec + 60,  # grace period
+			)
+		except asyncio.TimeoutError:
+			# The worker is stuck past run_flow's own timeout; stop sending work to it
+			_replace_process_pool(pool)
+			return {"success": False, "mobile_number": None, "details": {"messages": ["child_timeout"]}}
+		except BrokenProcessPool as e:
+			# A worker died mid-run; replace the pool so later requests still work
+			_replace_process_pool(pool)
+			return {"success": False, "mobile_number": None, "details": {"messages": [f"child_error: {e}"]}}
+		finally:
+			runs.discard(run)
+			if not runs and pool is not app.state.process_pool:
+				del _pool_runs[pool]
+				_teardown_process_pool(pool)
+
+async def _start_pooled_browser(slot: str):
+	# A slot is the profile it claimed at startup and keeps across relaunches
+	return await uc.start(headless=True, browser_args=[f"--user-data-dir={slot}", *BROWSER_ARGS])
+
+async def _relaunch_slot(slot: str, browser):
+	# Replace a dead pooled browser; None means the slot stays unhealthy
+	if browser:
+		try:
+			browser.stop()
 		except Exception:
 			pass
-		p.join(10)
-		result = {"success": False, "mobile_number": None, "details": {"messages": ["child_timeout"]}}
-	else:
-		try:
-			with open(out_path, "r", encoding="utf-8") as f:
-				result = json.load(f)
-		except Exception as e:
-			result = {"success": False, "mobile_number": None, "details": {"messages": [f"read_error: {e}"]}}
-	# Cleanup
 	try:
-		os.remove(out_path)
+		return await _start_pooled_browser(slot)
 	except Exception:
-		pass
-	return result
-
-@app.post("/run")
-async def run(
-	# Accept via query as a fallback to avoid 422 when body is not JSON
-	request: Request,
-	reg_no: Optional[str] = None,
-	chassis_no: Optional[str] = None,
-	rto_value: Optional[str] = "53",
-	headless: Optional[bool] = True,
-	timeout_sec: Optional[int] = 180,
-):
-	def to_bool(v):
-		if isinstance(v, bool): return v
-		if v is None: return None
-		if isinstance(v, (int, float)): return bool(v)
-		s = str(v).strip().lower()
-		return s in ("1", "true", "yes", "y", "on")
-	def to_int(v, default):
-		try:
-			return int(v)
-		except Exception:
-			return default
-
-	# If missing, try to read JSON body
-	if not reg_no or not chassis_no:
-		try:
-			payload = await request.json()
-			if isinstance(payload, dict):
-				reg_no = reg_no or payload.get("reg_no")
-				chassis_no = chassis_no or payload.get("chassis_no")
-				rto_value = payload.get("rto_value", rto_value)
-				headless = payload.get("headless", headless)
-				timeout_sec = payload.get("timeout_sec", timeout_sec)
-		except Exception:
-			# Try form data
+		return None
+
+async def start_browser_pool():
+	global _browser_pool
+	if ISOLATE:
+		app.state.process_pool = _new_process_pool()
+		app.state.worker_slots = asyncio.Semaphore(WORKERS)
+		return
+	_browser_pool = asyncio.Queue()
+	slots = [claim_profile("slot") for _ in range(POOL_SIZE)]
+	browsers = await asyncio.gather(*(_start_pooled_browser(slot) for slot in slots), return_exceptions=True)
+	for slot, browser in zip(slots, browsers):
+		_browser_pool.put_nowait((slot, None if isinstance(browser, BaseException) else browser))
+
+async def stop_browser_pool():
+	if ISOLATE:
+		app.state.process_pool.shutdown(wait=False, cancel_futures=True)
+		# Retired pools still finishing their last runs may hold a hung worker
+		for pool in list(_pool_runs):
+			if pool is not app.state.process_pool:
+				_teardown_process_pool(pool)
+	if _browser_pool is None:
+		return
+	while not _browser_pool.empty():
+		slot, browser = _browser_pool.get_nowait()
+		if browser:
 			try:
-				form = await request.form()
-				reg_no = reg_no or form.get("reg_no")
-				chassis_no = chassis_no or form.get("chassis_no")
-				rto_value = form.get("rto_value", rto_value)
-				headless = form.get("headless", headless)
-				timeout_sec = form.get("timeout_sec", timeout_sec)
+				browser.stop()
 			except Exception:
 				pass
+		release_profile(slot)
+
+class RunBody(BaseModel):
+	reg_no: str = Field(..., min_length=1)
+	chassis_no: str = Field(..., min_length=1)
+	rto_value: Optional[Union[str, int]] = "53"
+	headless: bool = True
+	timeout_sec: int = 180
+
+	@field_validator("rto_value")
+	@classmethod
+	def _rto_value_str(cls, v):
+		# Clients send 53 or "53"; null or "" falls back to the default, as before
+		return str(v) if v not in (None, "") else "53"
+
+@app.post("/run")
+async def run(body: RunBody):
+	return await _run(body)
+
+@app.post("/run/query")
+async def run_query(body: RunBody = Depends()):
+	# Same as /run for clients that send the fields as query parameters
+	return await _run(body)
 
-	if not reg_no or not chassis_no:
-		raise HTTPException(status_code=400, detail="reg_no and chassis_no are required")
+async def _run(body: RunBody) -> JSONResponse:
+	reg_no, chassis_no, rto_value = body.reg_no, body.chassis_no, body.rto_value
+	headless, timeout_sec = body.headless, body.timeout_sec
 
-	headless = True if headless is None else bool(to_bool(headless))
-	timeout_sec = to_int(timeout_sec, 180)
-	rto_value = rto_value or "53"
+	if ISOLATE:
+		out = await _run_isolated(reg_no, chassis_no, rto_value, headless, timeout_sec)
+		return JSONResponse(content=out)
 
-	# Instead of calling run_flow directly, execute in spawned child process
-	out = await asyncio.to_thread(_run_in_child_sync, reg_no, chassis_no, rto_value, headless, timeout_sec)
+	# Pool browsers are headless; headful runs launch their own browser
+	if not headless or _browser_pool is None:
+		out = await run_flow(reg_no=reg_no, chassis_no=chassis_no, rto_value=rto_value, headless=headless, timeout_sec=timeout_sec)
+		return JSONResponse(content=out)
+
+	slot, browser = await _browser_pool.get()
+	try:
+		if browser is None or browser.stopped:
+			browser = await _relaunch_slot(slot, browser)
+		# A slot that could not be revived (browser=None) runs with a one-off browser
+		out = await run_flow(reg_no=reg_no, chassis_no=chassis_no, rto_value=rto_value, headless=headless, timeout_sec=timeout_sec, browser=browser)
+	finally:
+		_browser_pool.put_nowait((slot, browser))
 	return JSONResponse(content=out)
 
 if __name__ == "__main__":